@@ -14,15 +14,28 @@
 # limitations under the License.
 #
 
+import atexit
 import datetime
+import difflib
+import fcntl
+import gzip
+import hashlib
 import os
 import pytest
+import requests
+import signal
 import subprocess
+import threading
 
 from collections import namedtuple
+from requests.adapters import HTTPAdapter
 from time import sleep
+from time import time
 
-my_epoch = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
 """Allows test interaction with the BIG-IP
 
@@ -38,18 +51,26 @@ my_epoch = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
                 runtime
             2. That the key-add to the shared key has already been performed
 
-    Diff files will be generated by `which diff` linux-builtin app.  These diff
-    results will be stored within /tmp/ under the format of:
+    Diff files will be generated in-memory by difflib against the snapshot,
+    which is itself kept gzip-compressed on disk.  These diff results will be
+    stored within /tmp/ under the format of:
         agent_only_bigip_<test>_<year><month><day><hour><minute><second>.diff
     Example:
         /tmp/agent_only_bigip_test_foo_20170703222353.diff
         for test_foo() at 2017/07/03 22:23:53 or 10:23:53 PM
-    Time stamps for this are captured at compile time, not during runtime or
-    at file generation time, so it is expected that the creation date may
+    Time stamps for this are captured the first time they are needed, not at
+    each file's generation time, so it is expected that the creation date may
     differ from the timestamp in the filename.  This was chosen due to wanting
     all files generated in a single test run to have the same timestamp.
+
+    The snapshot itself is stored as:
+        agent_only_bigip_snap_<sha1 of BIG-IP host and test run>.cfg.gz
+    so that pytest-xdist workers of the same run take a single snapshot and
+    share it instead of each extracting their own from the BIG-IP.
 """
 
+Result = namedtuple('Result', 'stdout, stdin, stderr, exit_status')
+
 
 class BigIpInteraction(object):
     """Class of simple class methods that open interaction with BIG-IP
@@ -58,41 +79,233 @@ class BigIpInteraction(object):
     configured for test runner's use.
     """
     __current_test = ''
+    __epoch = ''
     diff_file = '/tmp/agent_only_bigip_{}_{}.diff'
-    dirty_file = '/tmp/agent_only_bigip_dirty_{}_{}.cfg'
-    config_file = '/tmp/agent_only_bigip_{}.cfg'
+    config_file = '/tmp/agent_only_bigip_snap_{}.cfg.gz'
     _lbs_to_delete = []
-    ssh_cmd = ''
-    __extract_cmd = '''{} << EOF
-tmsh -c \"cd /;
-list sys folder recursive one-line" | cut -d " " -f3 |
-while read f; do echo \"====================\";
-echo \"Folder $f\"; tmsh -c "cd /$f; list\"; done;
-exit
-EOF'''
-    __ucs_cmd_fmt = "{} tmsh {} /sys ucs /tmp/backup.ucs"
+    _tracking_enabled = True
+    _snapshot_bytes = None
+    _snapshot_hash = None
+    bigip_host = ''
+    _http = None
+    ssh_options = ('ssh', '-o', 'StrictHostKeyChecking=no',
+                   '-o', 'UserKnownHostsFile=/dev/null',
+                   '-o', 'ControlMaster=auto',
+                   '-o', 'ControlPersist=600s')
+    ssh_control_path_fmt = 'ControlPath=/tmp/f5_ssh_%C_{}'
+    ssh_argv = ()
+    ssh_exit_argv = ()
+    _ssh_master_used = False
+    __extract_cmd = (
+        'tmsh -q -c "save sys config file /tmp/f5cfg_{0}.scf no-passphrase"'
+        ' > /dev/null && cat /tmp/f5cfg_{0}.scf; rc=$?;'
+        ' rm -f /tmp/f5cfg_{0}.scf /tmp/f5cfg_{0}.scf.tar; exit $rc')
+    ucs_file = '/tmp/backup.ucs'
+    __ucs_cmd_fmt = "tmsh {} /sys ucs {}"
+    __ready_cmd = 'tmsh -q -c "show sys version"'
+    __ucs_md5_fmt = '$(md5sum 2>/dev/null < {0} | cut -d" " -f1)'
+    __ucs_digest_cmd_fmt = (
+        'read cfg ucs 2>/dev/null < {0}.md5'
+        ' && test "' + __ucs_md5_fmt + '" = "$ucs" && echo $cfg')
+    __ucs_mark_cmd_fmt = 'echo {1} ' + __ucs_md5_fmt + ' > {0}.md5'
+    __ucs_unmark_cmd_fmt = 'rm -f {0}.md5'
+    __rest_url_fmt = 'https://{}/mgmt/tm/{}'
+    __section_fmt = '({}); rc=$?; echo; echo "===SECTION=== $rc";'
+    __section_marker = b'\n===SECTION=== '
+    _extract_cmd_final = ''
+    _ucs_save_cmd = ''
+    _ucs_load_cmd = ''
+    _exec_timeout = 60
+    _ucs_timeout = 300
 
-    @staticmethod
-    def __exec_shell(stdin, shell=False):
-        """Protected method for internal use"""
-        Result = namedtuple('Result', 'stdout, stdin, stderr, exit_status')
+    @classmethod
+    def __exec_shell(cls, remote_cmd, timeout=None):
+        """Protected method for internal use
+
+        remote_cmd := the command for the BIG-IP's shell, run over ssh_argv
+        """
+        cls._ssh_master_used = True
+        return cls.__exec_argv(list(cls.ssh_argv) + [remote_cmd], timeout)
+
+    @classmethod
+    def __exec_argv(cls, stdin, timeout=None):
+        """Protected method for internal use
+
+        stdin := the argv list to execute; no intermediate shell is spawned
+        timeout := seconds after which the process is killed (exit status 124)
+
+        The process runs in its own process group so that a timeout also
+        kills any children still holding its stdout open.  Being outside the
+        terminal's group, it does not see Ctrl-C either, so the group is also
+        killed when the wait is interrupted.  Its stdin is /dev/null.
+        """
+        with open(os.devnull, 'rb') as devnull:
+            proc = subprocess.Popen(stdin, stdin=devnull,
+                                    stdout=subprocess.PIPE,
+                                    preexec_fn=os.setsid)
+        expired = []
+
+        def killpg():
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+
+        def kill():
+            expired.append(True)
+            killpg()
+
+        timer = threading.Timer(timeout or cls._exec_timeout, kill)
+        timer.start()
         try:
-            stdout = subprocess.check_output(stdin, shell=shell)
+            stdout = proc.communicate()[0]
+        except BaseException:
+            if proc.poll() is None:
+                killpg()
+                proc.wait()
+            raise
+        finally:
+            timer.cancel()
+        if expired:
+            stderr = "Command '{}' timed out".format(stdin)
+            exit_status = 124
+        elif proc.returncode:
+            stderr = "Command '{}' returned non-zero exit status {}".format(
+                stdin, proc.returncode)
+            exit_status = proc.returncode
+        else:
             stderr = ''
             exit_status = 0
-        except subprocess.CalledProcessError as error:
-            stderr = str(error)
-            stdout = error.output
-            exit_status = error.returncode
 
         return Result(stdout, stdin, stderr, exit_status)
 
+    @classmethod
+    def __exec_rest(cls, path, payload, timeout=None):
+        """Protected method for internal use
+
+        Posts payload to the BIG-IP's iControl REST path over the pooled
+        session.  For util/bash, the command's output is returned as stdout.
+        """
+        try:
+            resp = cls._http.post(
+                cls.__rest_url_fmt.format(cls.bigip_host, path), json=payload,
+                timeout=timeout or cls._exec_timeout)
+            resp.raise_for_status()
+        except requests.exceptions.Timeout as error:
+            return Result(b'', payload, str(error), 124)
+        except requests.exceptions.RequestException as error:
+            status = getattr(error.response, 'status_code', None) or 1
+            return Result(b'', payload, str(error), status)
+        stdout = resp.content
+        if path == 'util/bash':
+            stdout = resp.json().get('commandResult', '').encode('utf-8')
+        return Result(stdout, payload, '', 0)
+
+    @classmethod
+    def __exec_remote(cls, remote_cmd, timeout=None):
+        """Runs remote_cmd in a shell on the BIG-IP
+
+        This goes over iControl REST when begin() set up an HTTP session, and
+        over the multiplexed ssh connection otherwise.  util/bash answers 200
+        whatever the command's exit status was, so over REST the command is
+        wrapped in a section marker from which its exit status is recovered.
+        """
+        if not cls._http:
+            return cls.__exec_shell(remote_cmd, timeout)
+        args = '-c ' + quote(cls.__section_fmt.format(remote_cmd))
+        result = cls.__exec_rest(
+            'util/bash', {'command': 'run', 'utilCmdArgs': args}, timeout)
+        if result.exit_status:
+            return result
+        stdout, marker, exit_status = \
+            result.stdout.rpartition(cls.__section_marker)
+        if not marker:
+            return Result(result.stdout, remote_cmd, 'Malformed output', 1)
+        exit_status = int(exit_status.strip())
+        stderr = ''
+        if exit_status:
+            stderr = "Command '{}' returned non-zero exit status {}".format(
+                remote_cmd, exit_status)
+        return Result(stdout, remote_cmd, stderr, exit_status)
+
+    @classmethod
+    def __exec_batch(cls, remote_cmds, timeout=None):
+        """Runs several remote_cmds in a single remote exec
+
+        Each command's output is followed by a section marker carrying its
+        exit status; one Result per command is split back out of the output.
+        """
+        script = ' '.join(cls.__section_fmt.format(cmd) for cmd in remote_cmds)
+        result = cls.__exec_remote(script, timeout)
+        chunks = result.stdout.split(cls.__section_marker)
+        if result.exit_status or len(chunks) != len(remote_cmds) + 1:
+            stderr = result.stderr or 'Malformed batch output'
+            return [Result(result.stdout, cmd, stderr, result.exit_status or 1)
+                    for cmd in remote_cmds]
+        results = []
+        stdout = chunks[0]
+        for cmd, chunk in zip(remote_cmds, chunks[1:]):
+            exit_status, _, rest = chunk.partition(b'\n')
+            results.append(Result(stdout, cmd, '', int(exit_status)))
+            stdout = rest
+        return results
+
+    @classmethod
+    def __exec_ucs(cls, command):
+        """Saves or loads the BIG-IP's UCS backup"""
+        if cls._http:
+            return cls.__exec_rest(
+                'sys/ucs', {'command': command, 'name': cls.ucs_file},
+                cls._ucs_timeout)
+        if command == 'load':
+            remote_cmd = cls._ucs_load_cmd
+        else:
+            remote_cmd = cls._ucs_save_cmd
+        return cls.__exec_shell(remote_cmd, cls._ucs_timeout)
+
+    @classmethod
+    def _epoch(cls):
+        """Returns the test run's timestamp, captured upon first use"""
+        if not cls.__epoch:
+            cls.__epoch = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        return cls.__epoch
+
+    @classmethod
+    def _snapshot_key(cls):
+        """Returns the key under which the run's snapshot is shared
+
+        pytest-xdist workers (PYTEST_XDIST_WORKER is set) are all spawned by
+        the same controller process, so its pid and start time identify the
+        run they share; the start time keeps a later run whose controller
+        reuses the pid from picking up a stale snapshot.  Newer xdist releases
+        also export PYTEST_XDIST_TESTRUNUID, which is preferred when present.
+        Outside of xdist, the run's epoch is used.
+        """
+        if 'PYTEST_XDIST_TESTRUNUID' in os.environ:
+            run_id = os.environ['PYTEST_XDIST_TESTRUNUID']
+        elif 'PYTEST_XDIST_WORKER' in os.environ:
+            ppid = os.getppid()
+            run_id = 'xdist-{}-{}'.format(ppid, cls.__process_start(ppid))
+        else:
+            run_id = cls._epoch()
+        key = '{}:{}'.format(cls.bigip_host, run_id)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    @staticmethod
+    def __process_start(pid):
+        """Returns pid's start time in clock ticks since boot, or ''"""
+        try:
+            with open('/proc/{}/stat'.format(pid)) as fh:
+                return fh.read().rpartition(')')[2].split()[19]
+        except (IOError, OSError, IndexError):
+            return ''
+
     @staticmethod
     def __check_results(results):
         if results.exit_status:
             raise RuntimeError(
-                "Could not extract bigip data!\nstderr:'{}'"
-                ";stdout'{}' ({})".format(results.stderr, results.stdout,
+                "Could not extract bigip data!\nstderr:{!r}"
+                ";stdout{!r} ({})".format(results.stderr, results.stdout,
                                           results.exit_status))
 
     @classmethod
@@ -101,11 +314,22 @@ EOF'''
 
         This method will perform the action of collecting BIG-IP config data.
         """
-        results = cls.__exec_shell(
-            cls.__extract_cmd.format(cls.ssh_cmd), shell=True)
+        results = cls.__exec_remote(cls._get_extract_cmd())
         cls.__check_results(results)
         return results.stdout
 
+    @classmethod
+    def _get_extract_cmd(cls):
+        """Returns the config extraction command
+
+        The command is formatted once, upon first use, so that the run's epoch
+        is still captured lazily.
+        """
+        if not cls._extract_cmd_final:
+            cls._extract_cmd_final = cls.__extract_cmd.format(
+                '{}_{}'.format(cls._epoch(), os.getpid()))
+        return cls._extract_cmd_final
+
     @classmethod
     def _get_existing_bigip_cfg(cls):
         """Extracts the BIG-IP config and stores it within instance
@@ -113,15 +337,92 @@ EOF'''
         This method will hold a copy of the existing BIG-IP config for later
         comparison.
         """
-        result = cls._get_current_bigip_cfg()
-        with open(cls.config_file.format(my_epoch), 'w') as fh:
+        cls.__store_snapshot(cls._get_current_bigip_cfg())
+
+    @classmethod
+    def __store_snapshot(cls, result, digest=None):
+        """Holds result as the snapshot and writes it to the config file
+
+        The on-disk copy is renamed into place so that a reader never sees a
+        partially written snapshot.  digest is result's md5 digest, when the
+        caller already has it.
+        """
+        cls.__set_snapshot(result, digest)
+        config_file = cls.config_file.format(cls._snapshot_key())
+        with gzip.open(config_file + '.tmp', 'wb', 3) as fh:
             fh.write(result)
+        os.rename(config_file + '.tmp', config_file)
+
+    @classmethod
+    def __set_snapshot(cls, result, digest=None):
+        cls._snapshot_bytes = result
+        cls._snapshot_hash = digest or hashlib.md5(result).digest()
+
+    @classmethod
+    def __load_snapshot(cls, config_file):
+        with gzip.open(config_file, 'rb') as fh:
+            cls.__set_snapshot(fh.read())
+
+    @classmethod
+    def __snapshot_and_backup(cls):
+        """Takes the snapshot and saves the UCS backup if it is out of date
+
+        The digest of the config each UCS backup was taken from, along with
+        the md5 of the UCS file itself, is kept next to it on the BIG-IP and
+        read back in the same remote exec as the config.  When both still
+        match, the multi-second UCS save is skipped.  The marker is removed
+        before a save and only rewritten once the save succeeded; the
+        snapshot is only stored once a matching backup exists.
+        """
+        config, ucs_digest = cls.__exec_batch(
+            [cls._get_extract_cmd(),
+             cls.__ucs_digest_cmd_fmt.format(cls.ucs_file)])
+        cls.__check_results(config)
+        config_md5 = hashlib.md5(config.stdout)
+        digest = config_md5.hexdigest()
+        if ucs_digest.exit_status or \
+                ucs_digest.stdout.strip() != digest.encode():
+            cls.__backup_to_ucs(digest)
+        cls.__store_snapshot(config.stdout, config_md5.digest())
+
+    @classmethod
+    def __backup_to_ucs(cls, digest):
+        unmark_cmd = cls.__ucs_unmark_cmd_fmt.format(cls.ucs_file)
+        mark_cmd = cls.__ucs_mark_cmd_fmt.format(cls.ucs_file, digest)
+        if cls._http:
+            cls.__check_results(cls.__exec_remote(unmark_cmd))
+            cls.__check_results(cls.__exec_ucs('save'))
+            cls.__check_results(cls.__exec_remote(mark_cmd))
+        else:
+            cls.__check_results(cls.__exec_shell(
+                ' && '.join([unmark_cmd, cls._ucs_save_cmd, mark_cmd]),
+                cls._ucs_timeout))
 
     @classmethod
     def __restore_from_backup(cls):
-        cmd = cls.__ucs_cmd_fmt.format(cls.ssh_cmd, 'load')
-        result = cls.__exec_shell(cmd, True)
+        """Loads the UCS backup, returning whether the BIG-IP answers again
+
+        Over ssh, the first readiness probe rides along in the same remote
+        exec as the load.
+        """
+        if cls._http:
+            cls.__check_results(cls.__exec_ucs('load'))
+            return False
+        result, ready = cls.__exec_batch(
+            [cls._ucs_load_cmd, cls.__ready_cmd], cls._ucs_timeout)
         cls.__check_results(result)
+        return not ready.exit_status
+
+    @classmethod
+    def _wait_ready(cls, timeout=5.0):
+        """Polls the BIG-IP until tmsh answers or timeout seconds pass"""
+        start = time()
+        while time() - start < timeout:
+            remaining = timeout - (time() - start)
+            result = cls.__exec_remote(cls.__ready_cmd, remaining)
+            if not result.exit_status:
+                return
+            sleep(0.1)
 
     @classmethod
     def _resulting_bigip_cfg(cls, test_method):
@@ -130,15 +431,16 @@ EOF'''
         This method will raise upon discovery of a polluted config against snap
         shot.  Upon a raise, it will also:
             * restore from backup
-            * Sleep 5 seconds to asssure the BIG-IP is ready for REST cmds
+            * Wait (up to 5 seconds) until the BIG-IP is ready for cmds
             * Generate a diff file against the polluted config
         """
         try:
-            diff_file = cls.__collect_diff(test_method)
-            # os.remove(diff_file)
+            cls.__collect_diff(test_method)
         except AssertionError as err:
-            cls.__restore_from_backup()
-            sleep(5)  # after nuke, BIG-IP needs a delay...
+            cls.__write_diff(
+                cls.diff_file.format(test_method, cls._epoch()), err.args[0])
+            if not cls.__restore_from_backup():
+                cls._wait_ready()  # after nuke, BIG-IP needs a delay...
             # raise AssertionError(
             #     "BIG-IP cfg was polluted by test!! (diff: {})".format(err))
 
@@ -148,34 +450,54 @@ EOF'''
 
         This method can force the collection of a diff at any time during the
         testing process and does not necessarily require a difference between
-        snapshot and current BIG-IP config.
+        snapshot and current BIG-IP config.  Returns the diff file, or None
+        when there was no difference to write.
         """
-        result = cls._get_current_bigip_cfg()
+        test_name = cls.__current_test
+        diff_file = cls.diff_file.format(test_name, cls._epoch())
         try:
-            diff_file = cls.__collect_diff(result)
-        except AssertionError as err:
-            diff_file = str(err)
-        return diff_file
+            cls.__collect_diff(test_name, out_path=diff_file)
+        except AssertionError:
+            return diff_file
+        return None
+
+    @staticmethod
+    def __write_diff(out_path, diff):
+        with open(out_path, 'wb') as fh:
+            fh.write(diff)
+
+    @staticmethod
+    def __unified_diff(before, after, fromfile, tofile):
+        """Returns the unified diff of two bytes configs as bytes"""
+        before = before.splitlines(True)
+        after = after.splitlines(True)
+        if hasattr(difflib, 'diff_bytes'):
+            lines = difflib.diff_bytes(
+                difflib.unified_diff, before, after, fromfile.encode(),
+                tofile.encode())
+        else:
+            lines = difflib.unified_diff(before, after, fromfile, tofile)
+        return b''.join(lines)
 
     @classmethod
-    def __collect_diff(cls, test_method):
-        """An internal method"""
-        dirty_file = cls.dirty_file.format(my_epoch, test_method)
-        session_file = cls.config_file.format(my_epoch)
+    def __collect_diff(cls, test_method, out_path=None):
+        """An internal method
+
+        Returns None when the current config is identical to the snapshot;
+        only upon a mismatch is the polluted config diffed against the
+        in-memory snapshot, raising an AssertionError that carries the diff.
+        The diff is written to out_path only when one is given.
+        """
         dirty_content = cls._get_current_bigip_cfg()
-        with open(dirty_file, 'w') as fh:
-            fh.write(dirty_content)
-        diff_file = cls.diff_file.format(test_method, my_epoch)
-        cmd = "diff -u {} {} > {}".format(
-            session_file, dirty_file, diff_file)
-        result = cls.__exec_shell(cmd, True)
-        try:
-            cls.__check_results(result)
-        except RuntimeError:
-            if os.path.getsize(diff_file) != os.path.getsize(session_file):
-                raise AssertionError(diff_file)
-        os.remove(dirty_file)
-        return diff_file
+        if dirty_content == cls._snapshot_bytes:
+            return None
+        diff = cls.__unified_diff(
+            cls._snapshot_bytes, dirty_content, 'snapshot', test_method)
+        if not diff:
+            return None
+        if out_path:
+            cls.__write_diff(out_path, diff)
+        raise AssertionError(diff)
 
     @classmethod
     def check_resulting_cfg(cls, test_name=None):
@@ -191,7 +513,7 @@ EOF'''
             cls.__current_test = test_name
         else:
             test_name = cls.__current_test
-        if not hasattr(pytest.symbols, 'no_bigip_tracking'):
+        if cls._tracking_enabled:
             cls._resulting_bigip_cfg(test_name)
 
     @classmethod
@@ -199,15 +521,36 @@ EOF'''
         """Performs a config backup of the BIG-IP's configuration
 
         This method will store a backup of the BIG-IP's configuration on the
-        BIG-IP for later restoration.
+        BIG-IP for later restoration.  Only the first process of a test run to
+        take the snapshot's lock performs the backup; the others load the
+        snapshot it left behind.  The UCS save itself is skipped when the
+        BIG-IP's existing backup was taken from an identical config.
         """
         cls.__current_test = test_name
-        if hasattr(pytest.symbols, 'no_bigip_tracking'):
-            pass
-        elif not os.path.isfile(cls.config_file.format(my_epoch)):
-            cls.__exec_shell(
-                cls.__ucs_cmd_fmt.format(cls.ssh_cmd, 'save'), True)
-            cls._get_existing_bigip_cfg()
+        if cls._tracking_enabled and cls._snapshot_hash is None:
+            config_file = cls.config_file.format(cls._snapshot_key())
+            with open(config_file + '.lock', 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if os.path.isfile(config_file):
+                    cls.__load_snapshot(config_file)
+                else:
+                    cls.__snapshot_and_backup()
+
+    @classmethod
+    def shutdown(cls):
+        """Closes the connections held open to the BIG-IP
+
+        This is registered with atexit by begin() so that neither the pooled
+        REST session nor the ControlPersist master outlives the test run.
+        The master is only asked to exit if this process ran an ssh command,
+        as otherwise there is no control socket to connect to.  The ssh call
+        bypasses __exec_argv's watchdog thread, which cannot be started cleanly
+        during interpreter shutdown.
+        """
+        if cls._http:
+            cls._http.close()
+        elif cls._ssh_master_used and cls.ssh_exit_argv:
+            subprocess.call(list(cls.ssh_exit_argv))
 
 
 def begin():
@@ -226,16 +569,40 @@ def begin():
     no justice if lingering config is later discovered.  It is; therefore,
     still recommended to run this as a last step to assure proper config
     tracking is assured.
+
+    All of a process's ssh invocations share a single multiplexed
+    ControlMaster connection so that only the first one pays for the full ssh
+    handshake.  The control socket is per process so that one pytest-xdist
+    worker exiting never tears down a master another worker is using.  Adding a
+    'bigip_rest_tracking' variable to the --symbols <file> instead performs
+    all tracking over iControl REST with bigip_username/bigip_password, using
+    a single pooled keep-alive session.
     """
-    ssh_options = """ssh -o StrictHostKeyChecking=no \
-    -o UserKnownHostsFile=/dev/null \
-    {}"""
+    ssh_options = BigIpInteraction.ssh_options + (
+        '-o', BigIpInteraction.ssh_control_path_fmt.format(os.getpid()))
     ssh_host_specific_fmt = "{}@{}"
     hostname = pytest.symbols.bigip_floating_ips[0]
     username = pytest.symbols.bigip_ssh_username
-    ssh_cmd = ssh_options.format(
-        ssh_host_specific_fmt.format(username, hostname))
-    BigIpInteraction.ssh_cmd = ssh_cmd
+    ssh_host = ssh_host_specific_fmt.format(username, hostname)
+    BigIpInteraction._tracking_enabled = \
+        not hasattr(pytest.symbols, 'no_bigip_tracking')
+    BigIpInteraction.bigip_host = hostname
+    BigIpInteraction.ssh_argv = ssh_options + (ssh_host,)
+    BigIpInteraction.ssh_exit_argv = ssh_options + ('-O', 'exit', ssh_host)
+    ucs_cmd_fmt = BigIpInteraction._BigIpInteraction__ucs_cmd_fmt
+    ucs_file = BigIpInteraction.ucs_file
+    BigIpInteraction._ucs_save_cmd = ucs_cmd_fmt.format('save', ucs_file)
+    BigIpInteraction._ucs_load_cmd = ucs_cmd_fmt.format('load', ucs_file)
+    if hasattr(pytest.symbols, 'bigip_rest_tracking'):
+        requests.packages.urllib3.disable_warnings()
+        http = requests.Session()
+        http.auth = (pytest.symbols.bigip_username,
+                     pytest.symbols.bigip_password)
+        http.verify = False
+        http.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        BigIpInteraction._http = http
+    if BigIpInteraction._tracking_enabled:
+        atexit.register(BigIpInteraction.shutdown)
 
 
 begin()
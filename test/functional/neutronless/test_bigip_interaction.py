@@ -0,0 +1,234 @@
+# coding=utf-8
+# Copyright (c) 2018, F5 Networks, Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""Tests BigIpInteraction's remote exec plumbing against a local bash.
+
+The BIG-IP's shell is replaced by a local ('bash', '-c') argv, and REST
+calls by a session that runs utilCmdArgs through a local bash, so none of
+these tests talk to a BIG-IP.  They still run as part of a functest session
+with --symbols: importing bigip_interaction runs its begin(), which reads
+pytest.symbols, and this directory's conftest imports the iControl driver.
+"""
+
+import pytest
+import shlex
+import signal
+import subprocess
+
+from .bigip_interaction import BigIpInteraction
+
+exec_argv = BigIpInteraction._BigIpInteraction__exec_argv
+exec_batch = BigIpInteraction._BigIpInteraction__exec_batch
+exec_remote = BigIpInteraction._BigIpInteraction__exec_remote
+snapshot_and_backup = BigIpInteraction._BigIpInteraction__snapshot_and_backup
+
+
+@pytest.fixture
+def local_shell(monkeypatch):
+    monkeypatch.setattr(BigIpInteraction, 'ssh_argv', ('bash', '-c'))
+    monkeypatch.setattr(BigIpInteraction, '_http', None)
+    monkeypatch.setattr(BigIpInteraction, '_ssh_master_used', False)
+
+
+class LocalBashResponse(object):
+    """Stands in for a util/bash response, running utilCmdArgs locally"""
+
+    def __init__(self, utilCmdArgs):
+        proc = subprocess.Popen(['bash'] + shlex.split(utilCmdArgs),
+                                stdout=subprocess.PIPE)
+        self.content = proc.communicate()[0]
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'commandResult': self.content.decode('utf-8')}
+
+
+class LocalBashSession(object):
+    def post(self, url, json=None, timeout=None):
+        assert url.endswith('/mgmt/tm/util/bash')
+        return LocalBashResponse(json['utilCmdArgs'])
+
+
+@pytest.fixture
+def local_rest(monkeypatch):
+    monkeypatch.setattr(BigIpInteraction, '_http', LocalBashSession())
+
+
+@pytest.fixture
+def local_ucs(local_shell, monkeypatch, tmpdir):
+    ucs_file = tmpdir.join('backup.ucs').strpath
+    saves = tmpdir.join('saves')
+    monkeypatch.setattr(BigIpInteraction, 'ucs_file', ucs_file)
+    monkeypatch.setattr(BigIpInteraction, 'config_file',
+                        tmpdir.join('snap_{}.cfg.gz').strpath)
+    monkeypatch.setattr(BigIpInteraction, '_extract_cmd_final',
+                        "printf 'cfg\\n'")
+    monkeypatch.setattr(
+        BigIpInteraction, '_ucs_save_cmd',
+        'echo ucs > {} && echo saved >> {}'.format(ucs_file, saves.strpath))
+    monkeypatch.setattr(BigIpInteraction, '_snapshot_bytes', None)
+    monkeypatch.setattr(BigIpInteraction, '_snapshot_hash', None)
+    return tmpdir
+
+
+@pytest.fixture
+def local_restore(local_ucs, monkeypatch):
+    monkeypatch.setattr(BigIpInteraction, 'diff_file',
+                        local_ucs.join('{}_{}.diff').strpath)
+    monkeypatch.setattr(BigIpInteraction, '_BigIpInteraction__epoch', 'now')
+    monkeypatch.setattr(BigIpInteraction, '_BigIpInteraction__ready_cmd',
+                        'true')
+    monkeypatch.setattr(
+        BigIpInteraction, '_ucs_load_cmd',
+        'echo loaded >> {}'.format(local_ucs.join('loads').strpath))
+    monkeypatch.setattr(BigIpInteraction, '_snapshot_bytes', b'cfg\n')
+    monkeypatch.setattr(BigIpInteraction, '_snapshot_hash', b'')
+    return local_ucs
+
+
+def test_exec_argv_exit_status():
+    assert exec_argv(['bash', '-c', 'exit 2']).exit_status == 2
+    result = exec_argv(['bash', '-c', 'printf out'])
+    assert result.stdout == b'out'
+    assert result.exit_status == 0
+
+
+def test_exec_argv_timeout():
+    result = exec_argv(['sleep', '5'], 0.2)
+    assert result.exit_status == 124
+    assert 'timed out' in result.stderr
+
+
+def test_exec_batch_splits_sections(local_shell):
+    results = exec_batch(['printf "a\\nb"', 'echo c', 'exit 3'])
+    assert [r.stdout for r in results] == [b'a\nb', b'c\n', b'']
+    assert [r.exit_status for r in results] == [0, 0, 3]
+    assert [r.stdin for r in results] == ['printf "a\\nb"', 'echo c',
+                                          'exit 3']
+
+
+def test_exec_batch_output_with_marker(local_shell):
+    results = exec_batch(['printf "x\\n===SECTION=== 0\\n"', 'echo y'])
+    assert [r.exit_status for r in results] == [1, 1]
+    assert all(r.stderr == 'Malformed batch output' for r in results)
+
+
+def test_exec_batch_timeout(local_shell):
+    results = exec_batch(['echo a', 'sleep 5'], 0.2)
+    assert [r.exit_status for r in results] == [124, 124]
+
+
+def test_snapshot_skips_ucs_save_when_marked(local_ucs):
+    snapshot_and_backup()
+    assert local_ucs.join('saves').read() == 'saved\n'
+    assert BigIpInteraction._snapshot_bytes == b'cfg\n'
+
+    BigIpInteraction._snapshot_hash = None
+    snapshot_and_backup()
+    assert local_ucs.join('saves').read() == 'saved\n'
+
+
+def test_snapshot_saves_when_ucs_replaced(local_ucs):
+    snapshot_and_backup()
+    local_ucs.join('backup.ucs').write('overwritten\n')
+    BigIpInteraction._snapshot_hash = None
+    snapshot_and_backup()
+    assert local_ucs.join('saves').read() == 'saved\nsaved\n'
+
+
+def test_snapshot_failed_save_leaves_no_marker(local_ucs, monkeypatch):
+    local_ucs.join('backup.ucs').write('ucs\n')
+    local_ucs.join('backup.ucs.md5').write('stale stale\n')
+    monkeypatch.setattr(BigIpInteraction, '_ucs_save_cmd', 'false')
+    with pytest.raises(RuntimeError):
+        snapshot_and_backup()
+    assert not local_ucs.join('backup.ucs.md5').check()
+    assert BigIpInteraction._snapshot_hash is None
+
+
+def test_snapshot_key_tracks_controller_start(monkeypatch):
+    monkeypatch.delenv('PYTEST_XDIST_TESTRUNUID', raising=False)
+    monkeypatch.setenv('PYTEST_XDIST_WORKER', 'gw0')
+    key = BigIpInteraction._snapshot_key()
+    monkeypatch.setattr(BigIpInteraction,
+                        '_BigIpInteraction__process_start',
+                        staticmethod(lambda pid: 'later'))
+    assert BigIpInteraction._snapshot_key() != key
+
+
+def test_exec_argv_interrupt_kills_group(monkeypatch):
+    def interrupt(proc, *args, **kwargs):
+        raise KeyboardInterrupt()
+
+    pids = []
+    popen = subprocess.Popen
+
+    def record(*args, **kwargs):
+        proc = popen(*args, **kwargs)
+        pids.append(proc)
+        return proc
+
+    monkeypatch.setattr(subprocess.Popen, 'communicate', interrupt)
+    monkeypatch.setattr(subprocess, 'Popen', record)
+    with pytest.raises(KeyboardInterrupt):
+        exec_argv(['sleep', '5'])
+    assert pids[0].returncode == -signal.SIGKILL
+
+
+def test_exec_argv_stdin_is_devnull():
+    assert exec_argv(['bash', '-c', 'cat']).stdout == b''
+
+
+def test_exec_remote_rest_quotes_command(local_rest):
+    result = exec_remote("printf '%s\\n' \"it's\" && exit 4")
+    assert result.stdout == b"it's\n"
+    assert result.exit_status == 4
+
+
+def test_exec_batch_rest(local_rest):
+    results = exec_batch(["echo 'a'", 'exit 3'])
+    assert [r.stdout for r in results] == [b'a\n', b'']
+    assert [r.exit_status for r in results] == [0, 3]
+
+
+def test_shutdown_skips_unused_master(monkeypatch, tmpdir):
+    exits = tmpdir.join('exits')
+    monkeypatch.setattr(BigIpInteraction, '_http', None)
+    monkeypatch.setattr(BigIpInteraction, '_ssh_master_used', False)
+    monkeypatch.setattr(BigIpInteraction, 'ssh_exit_argv',
+                        ('bash', '-c', 'echo exit >> ' + exits.strpath))
+    BigIpInteraction.shutdown()
+    assert not exits.check()
+
+    monkeypatch.setattr(BigIpInteraction, 'ssh_argv', ('bash', '-c'))
+    exec_remote('true')
+    BigIpInteraction.shutdown()
+    assert exits.read() == 'exit\n'
+
+
+def test_resulting_cfg_clean(local_restore):
+    BigIpInteraction._resulting_bigip_cfg('test_clean')
+    assert not local_restore.join('test_clean_now.diff').check()
+    assert not local_restore.join('loads').check()
+
+
+def test_resulting_cfg_polluted(local_restore, monkeypatch):
+    monkeypatch.setattr(BigIpInteraction, '_extract_cmd_final',
+                        "printf 'cfg\\ndirty\\n'")
+    BigIpInteraction._resulting_bigip_cfg('test_dirty')
+    assert local_restore.join('test_dirty_now.diff').read() == (
+        '--- snapshot\n+++ test_dirty\n@@ -1 +1,2 @@\n cfg\n+dirty\n')
+    assert local_restore.join('loads').read() == 'loaded\n'